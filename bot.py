@@ -1,11 +1,33 @@
+import sys
+
+# Use an accelerated, drop-in Deflate implementation for zipfile/pyzipper when one is installed.
+# This must run before zipfile and pyzipper are imported; the archive format is unchanged.
+try:
+    from isal import isal_zlib as _fast_zlib
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as _fast_zlib
+    except ImportError:
+        _fast_zlib = None
+if _fast_zlib is not None:
+    sys.modules['zlib'] = _fast_zlib
+
 import os
+import io
 import time
 import hashlib
+import mmap
 import logging
 import tempfile
+import shutil
 import asyncio
-import json
+import atexit
+import signal
+import orjson
 import configparser
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import zipfile
 from datetime import datetime, timedelta
 from telegram import Bot, InputFile
@@ -13,9 +35,18 @@ from telegram.constants import ParseMode
 from telegram.error import TelegramError
 from telegram.helpers import escape_markdown
 import pyzipper
-import requests
-from requests.exceptions import RequestException
+import aiohttp
 from aiolimiter import AsyncLimiter
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
 
 # --- DISCLAIMER ---
 # This script is for academic and research purposes only.
@@ -36,20 +67,37 @@ ENABLE_FORWARD = config['Telegram'].getboolean('enable_forward', False)
 # General Settings
 FOLDERS_TO_MONITOR = config['General']['folders_to_monitor'].split(',')
 CHECK_INTERVAL = int(config['General']['check_interval'])
+RECONCILE_INTERVAL = int(config['General'].get('reconcile_interval', 1800))  # Full rescan interval when watching for changes
 MAX_FILE_SIZE = 45 * 1024 * 1024  # 45 MB
+MAX_CONCURRENT_UPLOADS = 4  # Max parts of a split file uploaded at the same time
+HISTORY_FLUSH_INTERVAL = 5  # Seconds between file history writes
+PRECOMPRESSED_EXTENSIONS = {'.zip', '.gz', '.xz', '.zst', '.7z', '.rar', '.jpg', '.jpeg', '.png', '.mp3', '.mp4',
+                            '.mkv', '.webm', '.webp'}  # Formats that Deflate cannot shrink any further
+COPY_BUFFER_SIZE = 1 << 20  # 1 MiB; zipfile's own copy loop uses 8 KiB reads
+PIPELINE_QUEUE_SIZE = 2  # Max jobs waiting between pipeline stages (bounds temp disk usage)
+PIPELINE_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # Hash and zip workers each, so together they fill the process pool
 LOG_RETENTION_DAYS = int(config['General']['log_retention_days'])
+BACKEND_URL = 'http://localhost:5000'
 FILE_HISTORY_PATH = 'data/bot_file_history.json'
 FILE_SIZE_CACHE_PATH = 'data/file_size_cache.json'
+MD5_CACHE_PATH = 'data/md5_cache.json'
 ENABLE_ENCRYPTION = config['General'].getboolean('enable_encryption', False)
 ZIP_PASSWORD = config['General'].get('zip_password', '')
 ALLOWED_EXTENSIONS = set(config['General'].get('allowed_extensions', '').split(',')) if config['General'].get('allowed_extensions') else set()
+ALLOWED_EXTENSIONS_TUPLE = tuple(ALLOWED_EXTENSIONS)  # str.endswith accepts a tuple of suffixes
 ENABLE_CACHE = config['General'].getboolean('enable_cache', True)
 COMPRESSION_LEVEL = config['General'].get('compression_level', 'default').lower()
+ZSTD_LEVEL = int(config['General'].get('zstd_level', 12))
+ARCHIVE_EXTENSION = '.zst' if COMPRESSION_LEVEL == 'zstd' else '.zip'
 DISABLE_LOGS = config['General'].getboolean('disable_logs', False)
 
 # --- Configuration Validation ---
 if ENABLE_ENCRYPTION and COMPRESSION_LEVEL == 'none':
     raise ValueError("Error: Encryption cannot be enabled when compression is set to 'none'.")
+if ENABLE_ENCRYPTION and COMPRESSION_LEVEL == 'zstd':
+    raise ValueError("Error: Encryption cannot be enabled when compression is set to 'zstd'.")
+if COMPRESSION_LEVEL == 'zstd' and zstandard is None:
+    raise ValueError("Error: Compression 'zstd' requires the 'zstandard' package.")
 
 # --- Logging Configuration ---
 os.makedirs('logs', exist_ok=True)
@@ -68,13 +116,26 @@ else:
 # --- Global Variables ---
 bot = Bot(token=TOKEN)
 file_history = {}
+history_dirty = False  # Set when file_history has changes not yet written to disk
+hash_index = {}  # file hash -> file path, kept in sync with file_history
+pending_hashes = set()  # Hashes of files currently in the processing pipeline
 file_counter = 0
 file_size_cache = {}
+sorted_files_cache = None  # file_size_cache keys sorted by size; None when the cache has changed
+md5_cache = {}  # file_path -> [mtime_ns, size, md5]
+md5_cache_dirty = False  # Set when md5_cache has changes not yet written to disk
+changed_paths = set()  # Files reported by the filesystem watcher since the last pass
+unreadable_folders = set()  # Folders already reported as unscannable, so each is only warned about once
 error_messages = {}  # Store error message IDs
+http_session = None  # Shared aiohttp session for backend calls, reusing one keep-alive connection
 
 # Rate limiters to respect Telegram API limits
 message_limiter = AsyncLimiter(30, 1)  # 30 messages per second
 media_limiter = AsyncLimiter(20, 60)  # 20 media uploads per minute
+upload_semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)  # Bounds parts held in memory while uploading
+
+# Hashing and compression are CPU-bound and run in worker processes, off the event loop and the GIL
+process_pool = ProcessPoolExecutor(max_workers=2 * PIPELINE_WORKERS)
 
 # --- Utility Functions ---
 
@@ -82,34 +143,119 @@ def load_data(file_path):
     """Loads JSON data from a file."""
     os.makedirs('data', exist_ok=True)
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         logger.warning(f"File not found: {file_path}. Creating a new file.")
         return {}
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error(f"Error decoding JSON from {file_path}. Creating a new file.")
         return {}
 
 def save_data(data, file_path):
     """Saves JSON data to a file."""
+    write_json_bytes(orjson.dumps(data), file_path)
+
+def write_json_bytes(content, file_path):
+    """Atomically writes serialized JSON to a file, so a crash never leaves it half-written."""
     try:
-        with open(file_path, 'w') as f:
-            json.dump(data, f)
+        tmp_path = f'{file_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
         logger.info(f"Data saved to {file_path}")
     except Exception as e:
         logger.error(f"Error saving data to {file_path}: {str(e)}")
 
+async def history_flusher():
+    """Periodically writes the file history to disk if it has changed."""
+    global history_dirty
+    while True:
+        await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+        if history_dirty:
+            history_dirty = False
+            await asyncio.to_thread(write_json_bytes, orjson.dumps(file_history), FILE_HISTORY_PATH)
+
+def flush_file_history():
+    """Writes any pending file history changes to disk; registered to run at exit."""
+    global history_dirty
+    if history_dirty:
+        history_dirty = False
+        save_data(file_history, FILE_HISTORY_PATH)
+
+def signal_handler(sig, frame):
+    """Exits on SIGTERM so that pending file history is flushed by the atexit handler."""
+    logger.info("Bot terminated.")
+    sys.exit(0)
+
+class RangeReader(io.RawIOBase):
+    """A read-only view of a byte range of an open binary file."""
+
+    def __init__(self, file, offset, length):
+        super().__init__()
+        self._file = file
+        self._offset = offset
+        self._length = length
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self._length - self._position
+        if remaining <= 0:
+            return 0
+        with memoryview(buffer) as view:
+            self._file.seek(self._offset + self._position)
+            read = self._file.readinto(view[:remaining])
+        self._position += read
+        return read
+
+    def readall(self):
+        self._file.seek(self._offset + self._position)
+        data = self._file.read(self._length - self._position)
+        self._position += len(data)
+        return data
+
+async def run_in_process_pool(func, *args):
+    """Runs a CPU-bound function in the process pool and waits for its result."""
+    global process_pool
+    pool = process_pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); the pool is unusable from now on, so replace it and retry once
+        if process_pool is pool:
+            logger.warning("Process pool is broken. Restarting it.")
+            pool.shutdown(wait=False)
+            process_pool = ProcessPoolExecutor(max_workers=2 * PIPELINE_WORKERS)
+        return await asyncio.get_running_loop().run_in_executor(process_pool, func, *args)
+
 def calculate_md5(file_path):
     """Calculates the MD5 hash of a file."""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-async def send_file(file_path, caption, part_number=None, total_parts=None):
-    """Sends a file to Telegram, handling rate limits and potential errors."""
+    with open(file_path, "rb", buffering=0) as f:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(f, 'md5').hexdigest()
+        hash_md5 = hashlib.md5()
+        if os.fstat(f.fileno()).st_size:  # mmap cannot map empty files
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hash_md5.update(mm)
+        return hash_md5.hexdigest()
+
+async def get_file_hash(file_path, stat):
+    """Returns the MD5 hash of a file, reusing the cached digest if mtime and size are unchanged."""
+    cached = md5_cache.get(file_path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    file_hash = await run_in_process_pool(calculate_md5, file_path)
+    global md5_cache_dirty
+    md5_cache[file_path] = [stat.st_mtime_ns, stat.st_size, file_hash]
+    md5_cache_dirty = True
+    return file_hash
+
+async def send_file(file_path, caption, part_number=None, total_parts=None, byte_range=None, file_name=None):
+    """Sends a file, or a (offset, length) byte range of it, to Telegram, handling rate limits and potential errors."""
+    file_key = file_name or file_path
     async with media_limiter:
         try:
             escaped_caption = escape_markdown(caption, version=2)
@@ -117,18 +263,22 @@ async def send_file(file_path, caption, part_number=None, total_parts=None):
                 escaped_caption += f"\n\\(Part {part_number}/{total_parts}\\)"
 
             with open(file_path, 'rb') as file:
+                if byte_range is not None:
+                    document = InputFile(RangeReader(file, *byte_range), filename=file_name)
+                else:
+                    document = InputFile(file)
                 message = await bot.send_document(chat_id=CHAT_ID, 
-                                                  document=InputFile(file),
+                                                  document=document,
                                                   caption=escaped_caption, 
                                                   parse_mode=ParseMode.MARKDOWN_V2)
-            logger.info(f"File sent successfully: {file_path}")
+            logger.info(f"File sent successfully: {file_key}")
 
             if ENABLE_FORWARD:
                 await forward_message(message)
 
-            if file_path in error_messages:
-                await bot.delete_message(chat_id=CHAT_ID, message_id=error_messages[file_path])
-                del error_messages[file_path]
+            if file_key in error_messages:
+                await bot.delete_message(chat_id=CHAT_ID, message_id=error_messages[file_key])
+                del error_messages[file_key]
 
             return True
         except TelegramError as e:
@@ -136,12 +286,12 @@ async def send_file(file_path, caption, part_number=None, total_parts=None):
                 retry_after = int(e.response.headers.get('Retry-After', 1))
                 logger.warning(f"Flood control exceeded. Retrying in {retry_after} seconds.")
                 await asyncio.sleep(retry_after)
-                return await send_file(file_path, caption, part_number, total_parts)
+                return await send_file(file_path, caption, part_number, total_parts, byte_range, file_name)
             else:
-                logger.error(f"Error sending file {file_path}: {str(e)}")
+                logger.error(f"Error sending file {file_key}: {str(e)}")
                 error_message = await bot.send_message(chat_id=CHAT_ID, 
-                                                       text=f"Error sending file: {file_path}. Check logs.")
-                error_messages[file_path] = error_message.message_id
+                                                       text=f"Error sending file: {file_key}. Check logs.")
+                error_messages[file_key] = error_message.message_id
                 return False
 
 async def forward_message(message):
@@ -170,32 +320,39 @@ async def split_and_send_zip(file_path, skip_zip=False):
 
             logger.info(f"Splitting file: {zip_path}")
             chunk_size = MAX_FILE_SIZE
-            file_number = 1
-            total_parts = os.path.getsize(zip_path) // chunk_size + (1 if os.path.getsize(zip_path) % chunk_size else 0)
-
-            with open(zip_path, 'rb') as zip_file:
-                while True:
-                    chunk = zip_file.read(chunk_size)
-                    if not chunk:
-                        break
-
-                    chunk_name = os.path.join(temp_dir, f'{base_name}.{file_number:03d}')
-                    with open(chunk_name, 'wb') as chunk_file:
-                        chunk_file.write(chunk)
-
-                    logger.info(f"Sending part {file_number}/{total_parts}: {chunk_name}")
-                    caption = f"Part {file_number} of {base_name}"
-                    success = await send_file(chunk_name, caption, part_number=file_number, total_parts=total_parts)
-                    if not success:
-                        logger.error(f"Failed to send part {file_number} of {base_name}")
+            zip_size = os.path.getsize(zip_path)
+            total_parts = zip_size // chunk_size + (1 if zip_size % chunk_size else 0)
+
+            async def send_part(part_number, offset):
+                chunk_name = f'{base_name}.{part_number:03d}'
+                async with upload_semaphore:
+                    logger.info(f"Sending part {part_number}/{total_parts}: {chunk_name}")
+                    caption = f"Part {part_number} of {base_name}"
+                    success = await send_file(zip_path, caption, part_number=part_number, total_parts=total_parts,
+                                              byte_range=(offset, min(chunk_size, zip_size - offset)),
+                                              file_name=chunk_name)
+                if not success:
+                    logger.error(f"Failed to send part {part_number} of {base_name}")
+                return success
+
+            # Parts are streamed straight from the archive and uploaded concurrently;
+            # media_limiter still caps the overall upload rate
+            tasks = [asyncio.create_task(send_part(part_number, offset)) for part_number, offset
+                     in enumerate(range(0, zip_size, chunk_size), start=1)]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    if not await task:
                         return False, 0
-
-                    file_number += 1
                     file_counter += 1
+            finally:
+                # Stop the remaining parts on the first failure so they don't use up the upload budget
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
 
-            await send_reassembly_instructions(base_name, file_number)
+            await send_reassembly_instructions(base_name, total_parts)
 
-            if not skip_zip and COMPRESSION_LEVEL != 'none' and not file_path.lower().endswith('.zip'):
+            if zip_path != file_path:
                 os.remove(zip_path)
                 logger.debug(f"Deleted temporary zipped file: {zip_path}")
 
@@ -205,37 +362,69 @@ async def split_and_send_zip(file_path, skip_zip=False):
         await send_error_message(base_name)
         return False, 0
 
+def is_precompressed(file_path):
+    """Checks whether the file is in a format that is already compressed."""
+    return os.path.splitext(file_path)[1].lower() in PRECOMPRESSED_EXTENSIONS
+
 async def create_zip_archive(file_path, base_name, temp_dir, skip_zip):
-    """Creates a zip archive of the file, either compressing it or using the original if it's already a zip."""
-    if not skip_zip and COMPRESSION_LEVEL != 'none' and not file_path.lower().endswith('.zip'):
-        zip_path = os.path.join(temp_dir, f'{base_name}.zip')
+    """Creates a zip archive of the file, either compressing it or using the original if it's already compressed."""
+    if (not skip_zip and COMPRESSION_LEVEL != 'none' and not file_path.lower().endswith(ARCHIVE_EXTENSION)
+            and (ENABLE_ENCRYPTION or not is_precompressed(file_path))):
+        zip_path = os.path.join(temp_dir, f'{base_name}{ARCHIVE_EXTENSION}')
         logger.info(f"Compressing file: {file_path}")
-        compression = zipfile.ZIP_DEFLATED if COMPRESSION_LEVEL == 'default' else zipfile.ZIP_STORED
-        if ENABLE_ENCRYPTION:
-            with pyzipper.AESZipFile(zip_path, 'w', compression=compression,
-                                     encryption=pyzipper.WZ_AES) as zipf:
-                zipf.setpassword(ZIP_PASSWORD.encode())
-                zipf.write(file_path, base_name)
-        else:
-            with zipfile.ZipFile(zip_path, 'w', compression) as zipf:
-                zipf.write(file_path, base_name)
+        await run_in_process_pool(compress_file, file_path, base_name, zip_path)
         return zip_path
     else:
         return file_path
 
-async def send_reassembly_instructions(base_name, file_number):
+def compress_file(file_path, base_name, zip_path):
+    """Writes the file into a new zip archive (or zstd frame), encrypting it if enabled."""
+    if COMPRESSION_LEVEL == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+        with open(file_path, 'rb') as src, open(zip_path, 'wb') as dst:
+            with compressor.stream_writer(dst, size=os.fstat(src.fileno()).st_size) as writer:
+                shutil.copyfileobj(src, writer, length=COPY_BUFFER_SIZE)
+        return
+
+    if COMPRESSION_LEVEL == 'default' and not is_precompressed(file_path):
+        compression = zipfile.ZIP_DEFLATED
+    else:
+        compression = zipfile.ZIP_STORED  # Encryption still applies, only the wasted Deflate pass is skipped
+    if ENABLE_ENCRYPTION:
+        with pyzipper.AESZipFile(zip_path, 'w', compression=compression,
+                                 encryption=pyzipper.WZ_AES) as zipf:
+            zipf.setpassword(ZIP_PASSWORD.encode())
+            write_to_zip(zipf, zipf.zipinfo_cls, file_path, base_name, compression)
+    else:
+        with zipfile.ZipFile(zip_path, 'w', compression) as zipf:
+            write_to_zip(zipf, zipfile.ZipInfo, file_path, base_name, compression)
+
+def write_to_zip(zipf, zipinfo_cls, file_path, base_name, compression):
+    """Writes a file into an open zip archive like ZipFile.write, but copying with a larger buffer."""
+    zinfo = zipinfo_cls.from_file(file_path, base_name)
+    zinfo.compress_type = compression
+    with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+        shutil.copyfileobj(src, dst, length=COPY_BUFFER_SIZE)
+
+async def send_reassembly_instructions(base_name, total_parts):
     """Sends instructions to the user on how to reassemble the split files."""
     encryption_note = "The ZIP file is encrypted. You'll need the password to extract it." if ENABLE_ENCRYPTION else "The ZIP file is not encrypted."
+    if base_name.lower().endswith('.zst'):
+        extract_step = f"Decompress {base_name} with: zstd -d {base_name}"
+    elif base_name.lower().endswith('.zip'):
+        extract_step = f"Extract {base_name}"
+    else:
+        extract_step = f"{base_name} is ready to use, no extraction needed"
     instructions = f"""```
 To reassemble the file:
-1. Download all parts ({file_number - 1} in total)
+1. Download all parts ({total_parts} in total)
 2. Use one of the following commands:
    # Windows
-   copy /b {base_name}.zip.* {base_name}.zip
+   copy /b {base_name}.* {base_name}
 
    # Linux/Mac
-   cat {base_name}.zip.* > {base_name}.zip
-3. Extract {base_name}.zip
+   cat {base_name}.* > {base_name}
+3. {extract_step}
 
 {encryption_note}
 ```"""
@@ -251,10 +440,9 @@ async def send_error_message(base_name):
         await bot.send_message(chat_id=CHAT_ID, text=f"Error processing file: {base_name}. Check logs.")
 
 async def send_event_to_backend(event_type, file_name, file_id, file_hash, file_size, processing_time,
-                               upload_speed):
+                               upload_speed, archive_name=None):
     """Sends an event to the backend server, logging any errors."""
     try:
-        backend_url = 'http://localhost:5000/event'
         data = {
             'type': event_type,
             'file': file_name,
@@ -262,86 +450,166 @@ async def send_event_to_backend(event_type, file_name, file_id, file_hash, file_
             'hash': file_hash,
             'file_size': file_size,
             'processing_time': processing_time,
-            'upload_speed': upload_speed
+            'upload_speed': upload_speed,
+            'archive_name': archive_name
         }
-        response = requests.post(backend_url, json=data, timeout=5)
-        if not response.ok:
-            logger.warning(f"Error sending event to backend: {response.text}")
-    except RequestException as e:
+        async with http_session.post(f'{BACKEND_URL}/event', json=data) as response:
+            if not response.ok:
+                logger.warning(f"Error sending event to backend: {await response.text()}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.warning(f"Unable to connect to backend: {str(e)}")
 
-async def process_file(file_path):
-    """Processes a file, compressing, splitting, and sending it to Telegram."""
-    global file_counter
+# --- Processing Pipeline ---
+# Files flow through three stages connected by bounded queues, so that the upload
+# of one file overlaps with the compression of the next and the hashing of the one after:
+#   path_queue -> hash_worker -> zip_queue -> zip_worker -> send_queue -> send_worker
+# The CPU-bound hash and zip stages each run PIPELINE_WORKERS workers on the process pool.
+
+async def hash_file(file_path):
+    """Hashes a file and returns a pipeline job for it, or None if the file should be skipped."""
     start_time = time.time()
-    file_hash = calculate_md5(file_path)
-    original_size = os.path.getsize(file_path)
     base_name = os.path.basename(file_path)
-    upload_start_time = time.time()
 
-    if any(file_data['hash'] == file_hash for file_data in file_history.values()):
-        logger.info(f"File with the same hash already exists: {file_path}")
-        return
-
-    if ALLOWED_EXTENSIONS and not any(base_name.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS):
+    if ALLOWED_EXTENSIONS and not base_name.lower().endswith(ALLOWED_EXTENSIONS_TUPLE):
         logger.info(f"File ignored (extension not allowed): {file_path}")
-        return
+        return None
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        if COMPRESSION_LEVEL == 'none' or (file_path.lower().endswith('.zip') and not ENABLE_ENCRYPTION):
-            send_path = file_path
-        else:
-            send_path = os.path.join(temp_dir, f'{base_name}.zip')
-            logger.info(f"Compressing file: {file_path} into {send_path}")
-            compression = zipfile.ZIP_DEFLATED if COMPRESSION_LEVEL == 'default' else zipfile.ZIP_STORED
-            if ENABLE_ENCRYPTION:
-                with pyzipper.AESZipFile(send_path, 'w', compression=compression, encryption=pyzipper.WZ_AES) as zipf:
-                    zipf.setpassword(ZIP_PASSWORD.encode())
-                    zipf.write(file_path, base_name)
-            else:
-                with zipfile.ZipFile(send_path, 'w', compression) as zipf:
-                    zipf.write(file_path, base_name)
+    stat = os.stat(file_path)
+    file_hash = await get_file_hash(file_path, stat)
 
-        if file_path not in file_history or file_history[file_path]['hash'] != file_hash:
-            logger.info(f"New file detected or file modified: {file_path}")
+    if file_hash in hash_index or file_hash in pending_hashes:
+        logger.info(f"File with the same hash already exists: {file_path}")
+        return None
+
+    logger.info(f"New file detected or file modified: {file_path}")
+    pending_hashes.add(file_hash)
+    return {
+        'file_path': file_path,
+        'file_hash': file_hash,
+        'original_size': stat.st_size,
+        'start_time': start_time,
+        'temp_dir': None,
+        'send_path': file_path
+    }
+
+async def compress_job(job):
+    """Compresses the job's file into a temporary directory unless it can be sent as-is."""
+    file_path = job['file_path']
+    base_name = os.path.basename(file_path)
+    if COMPRESSION_LEVEL == 'none' or (not ENABLE_ENCRYPTION and (file_path.lower().endswith(ARCHIVE_EXTENSION)
+                                                                  or is_precompressed(file_path))):
+        return job
+
+    job['temp_dir'] = tempfile.mkdtemp()
+    job['send_path'] = os.path.join(job['temp_dir'], f'{base_name}{ARCHIVE_EXTENSION}')
+    logger.info(f"Compressing file: {file_path} into {job['send_path']}")
+    await run_in_process_pool(compress_file, file_path, base_name, job['send_path'])
+    return job
+
+async def send_job(job):
+    """Sends the job's (possibly compressed) file to Telegram, records the result and returns whether it succeeded."""
+    global file_counter, history_dirty
+    file_path = job['file_path']
+    file_hash = job['file_hash']
+    original_size = job['original_size']
+    send_path = job['send_path']
+    base_name = os.path.basename(file_path)
+    upload_start_time = time.time()
 
-            if os.path.getsize(send_path) > MAX_FILE_SIZE:
-                logger.info(f"File size exceeds {MAX_FILE_SIZE} bytes. Splitting and sending: {send_path}")
-                if send_path.lower().endswith('.zip'):
-                    success, file_size = await split_and_send_zip(send_path, skip_zip=True)
-                else:
-                    success, file_size = await split_and_send_zip(send_path)
-            else:
-                logger.info(f"Sending file: {send_path}")
-                encryption_status = "🔒 Encrypted" if ENABLE_ENCRYPTION else "🔓 Not encrypted"
-                caption = f"File: {base_name}\n{encryption_status}"
-                success = await send_file(send_path, caption)
-                file_size = os.path.getsize(send_path)
-
-            if success:
-                file_counter += 1
-                encryption_algorithm = "AES" if ENABLE_ENCRYPTION else "None"
-                processing_time = (time.time() - start_time) * 1000
-                upload_speed = file_size / (time.time() - upload_start_time) if (
-                            time.time() - upload_start_time) != 0 else 0
-                file_history[file_path] = {
-                    'hash': file_hash,
-                    'last_sent': datetime.now().isoformat(),
-                    'send_success': True,
-                    'encrypted': ENABLE_ENCRYPTION,
-                    'encryption_algorithm': encryption_algorithm,
-                    'file_id': file_counter,
-                    'file_size': original_size,
-                    'processed_size': file_size,
-                    'processing_time': processing_time,
-                    'upload_speed': upload_speed
-                }
-                save_data(file_history, FILE_HISTORY_PATH)
-                await send_event_to_backend('success', base_name, file_counter, file_hash, original_size,
-                                           processing_time, upload_speed)
-            else:
-                logger.error(f"Failed to send file: {file_path}")
-                await send_event_to_backend('failure', base_name, file_counter, file_hash, original_size, 0, 0)
+    if os.path.getsize(send_path) > MAX_FILE_SIZE:
+        logger.info(f"File size exceeds {MAX_FILE_SIZE} bytes. Splitting and sending: {send_path}")
+        if send_path.lower().endswith(ARCHIVE_EXTENSION):
+            success, file_size = await split_and_send_zip(send_path, skip_zip=True)
+        else:
+            success, file_size = await split_and_send_zip(send_path)
+    else:
+        logger.info(f"Sending file: {send_path}")
+        encryption_status = "🔒 Encrypted" if ENABLE_ENCRYPTION else "🔓 Not encrypted"
+        caption = f"File: {base_name}\n{encryption_status}"
+        success = await send_file(send_path, caption)
+        file_size = os.path.getsize(send_path)
+
+    if success:
+        file_counter += 1
+        encryption_algorithm = "AES" if ENABLE_ENCRYPTION else "None"
+        processing_time = (time.time() - job['start_time']) * 1000
+        upload_speed = file_size / (time.time() - upload_start_time) if (
+                    time.time() - upload_start_time) != 0 else 0
+        previous = file_history.get(file_path)
+        if previous and hash_index.get(previous['hash']) == file_path:
+            del hash_index[previous['hash']]
+        file_history[file_path] = {
+            'hash': file_hash,
+            'last_sent': datetime.now().isoformat(),
+            'send_success': True,
+            'encrypted': ENABLE_ENCRYPTION,
+            'encryption_algorithm': encryption_algorithm,
+            'file_id': file_counter,
+            'archive_name': os.path.basename(send_path),
+            'file_size': original_size,
+            'processed_size': file_size,
+            'processing_time': processing_time,
+            'upload_speed': upload_speed
+        }
+        hash_index[file_hash] = file_path
+        history_dirty = True
+        await send_event_to_backend('success', base_name, file_counter, file_hash, original_size,
+                                   processing_time, upload_speed, os.path.basename(send_path))
+    else:
+        logger.error(f"Failed to send file: {file_path}")
+        await send_event_to_backend('failure', base_name, file_counter, file_hash, original_size, 0, 0)
+    return success
+
+def retry_later(file_path):
+    """Queues a failed file for the next pass; in watch mode it would otherwise wait for the next full rescan."""
+    changed_paths.add(file_path)
+
+def release_job(job):
+    """Removes the job's temporary files and releases its hash from the pipeline."""
+    pending_hashes.discard(job['file_hash'])
+    if job['temp_dir']:
+        shutil.rmtree(job['temp_dir'], ignore_errors=True)
+
+async def hash_worker(path_queue, zip_queue):
+    """Pipeline stage: hashes queued paths and forwards new files to the compression stage."""
+    while True:
+        file_path = await path_queue.get()
+        try:
+            job = await hash_file(file_path)
+            if job:
+                await zip_queue.put(job)
+        except Exception as e:
+            logger.error(f"Error hashing file {file_path}: {str(e)}")
+            retry_later(file_path)
+        finally:
+            path_queue.task_done()
+
+async def zip_worker(zip_queue, send_queue):
+    """Pipeline stage: compresses hashed files and forwards them to the sending stage."""
+    while True:
+        job = await zip_queue.get()
+        try:
+            await send_queue.put(await compress_job(job))
+        except Exception as e:
+            logger.error(f"Error compressing file {job['file_path']}: {str(e)}")
+            retry_later(job['file_path'])
+            release_job(job)
+        finally:
+            zip_queue.task_done()
+
+async def send_worker(send_queue):
+    """Pipeline stage: uploads compressed files to Telegram."""
+    while True:
+        job = await send_queue.get()
+        try:
+            if not await send_job(job):
+                retry_later(job['file_path'])
+        except Exception as e:
+            logger.error(f"Error sending file {job['file_path']}: {str(e)}")
+            retry_later(job['file_path'])
+        finally:
+            release_job(job)
+            send_queue.task_done()
 
 def clean_old_logs():
     """Deletes old log files based on the configured retention period."""
@@ -356,64 +624,199 @@ def clean_old_logs():
                 os.remove(file_path)
                 logger.info(f"Log file deleted for privacy: {filename}")
 
+class ChangedFileHandler(FileSystemEventHandler):
+    """Collects the paths of files created, modified or moved into the monitored folders."""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ('created', 'modified', 'moved'):
+            return
+        file_path = event.dest_path if event.event_type == 'moved' else event.src_path
+        # Events arrive on the observer thread; hand them over to the event loop
+        self.loop.call_soon_threadsafe(changed_paths.add, file_path)
+
+def start_observer(loop):
+    """Starts watching the monitored folders for changes, or returns None if watchdog is unavailable."""
+    if Observer is None:
+        logger.info("watchdog is not installed. Falling back to scanning every check interval.")
+        return None
+    observer = Observer()
+    handler = ChangedFileHandler(loop)
+    for folder in FOLDERS_TO_MONITOR:
+        if not os.path.isdir(folder):
+            logger.error(f"Unable to watch folder {folder}: not a directory")
+            continue
+        observer.schedule(handler, folder, recursive=True)
+    try:
+        observer.start()
+    except OSError as e:
+        logger.error(f"Unable to start watching folders: {str(e)}. Falling back to scanning every check interval.")
+        return None
+    logger.info("Watching monitored folders for changes.")
+    return observer
+
+def take_changed_files():
+    """Returns the files changed since the last pass, smallest first, and resets the change set."""
+    sizes = {}
+    for file_path in changed_paths:
+        try:
+            sizes[file_path] = os.path.getsize(file_path)
+        except OSError:
+            pass  # Deleted or moved away since the event was reported
+    changed_paths.clear()
+    if ENABLE_CACHE and any(file_size_cache.get(file_path) != size for file_path, size in sizes.items()):
+        global sorted_files_cache
+        file_size_cache.update(sizes)
+        sorted_files_cache = None
+    return sorted(sizes, key=sizes.get)
+
+def scan_monitored_files():
+    """Scans all monitored folders and returns every file, smallest first."""
+    if ENABLE_CACHE:
+        global sorted_files_cache
+        build_file_size_cache()
+        # Sort by size, smallest first, only when the cache has changed since the last sort
+        if sorted_files_cache is None:
+            sorted_files_cache = [file_path for file_path, _ in sorted(file_size_cache.items(), key=itemgetter(1))]
+        return sorted_files_cache
+
+    file_sizes = [item for folder in FOLDERS_TO_MONITOR for item in iter_files(folder)]
+    return [file_path for file_path, _ in sorted(file_sizes, key=itemgetter(1))]  # Sort by size, smallest first
+
+def iter_files(root):
+    """Yields (path, size) for every file under root, using the stat cached by os.scandir."""
+    try:
+        entries = os.scandir(root)
+    except OSError as e:
+        # Unreadable or vanished directories are skipped, as os.walk did; warn only the first time
+        if root in unreadable_folders:
+            logger.debug(f"Unable to scan folder {root}: {str(e)}")
+        else:
+            unreadable_folders.add(root)
+            logger.warning(f"Unable to scan folder {root}: {str(e)}")
+        return
+
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    is_dir = True
+                elif entry.is_file():
+                    is_dir = False
+                    size = entry.stat().st_size
+                else:
+                    continue
+            except OSError as e:
+                # The entry vanished or became unreadable after it was listed; skip just this one
+                logger.debug(f"Unable to stat {entry.path}: {str(e)}")
+                continue
+            if is_dir:
+                yield from iter_files(entry.path)
+            else:
+                yield entry.path, size
+
+def prune_md5_cache(existing_files):
+    """Drops cached digests for files that no longer exist in the monitored folders."""
+    global md5_cache_dirty
+    stale_paths = md5_cache.keys() - set(existing_files)
+    for file_path in stale_paths:
+        del md5_cache[file_path]
+    if stale_paths:
+        md5_cache_dirty = True
+
 def build_file_size_cache():
     """Creates a cache of file sizes for faster processing."""
-    global file_size_cache
+    global file_size_cache, sorted_files_cache
+    file_sizes = {}
     for folder in FOLDERS_TO_MONITOR:
-        for root, _, files in os.walk(folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_size_cache[file_path] = os.path.getsize(file_path)
-    save_data(file_size_cache, FILE_SIZE_CACHE_PATH)
+        file_sizes.update(iter_files(folder))
+    if file_sizes != file_size_cache:
+        file_size_cache = file_sizes
+        sorted_files_cache = None
+        save_data(file_size_cache, FILE_SIZE_CACHE_PATH)
     logger.info("File size cache built.")
 
 async def main():
-    global file_history, file_counter, file_size_cache
+    global file_history, hash_index, file_counter, file_size_cache, md5_cache, md5_cache_dirty, http_session
     logger.info("Bot started.")
     print("Bot started. Press Ctrl+C to interrupt.")
 
     file_history = load_data(FILE_HISTORY_PATH)
+    hash_index = {file_data['hash']: file_path for file_path, file_data in file_history.items()}
     file_counter = max(file_history.values(), key=lambda x: x.get('file_id', 0), default={}).get('file_id', 0)
     if ENABLE_CACHE:
         file_size_cache = load_data(FILE_SIZE_CACHE_PATH)
+        md5_cache = load_data(MD5_CACHE_PATH)
 
-    try:
-        backend_url = 'http://localhost:5000/file_history'
-        response = requests.post(backend_url, json=file_history, timeout=5)
-        if not response.ok:
-            logger.warning(f"Error sending file history to backend: {response.text}")
-    except RequestException as e:
-        logger.warning(f"Unable to connect to backend: {str(e)}")
-        print(f"Error: Unable to connect to backend. Please check if the Flask backend is running.")
-
-    while True:
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as http_session:
         try:
-            clean_old_logs()
+            async with http_session.post(f'{BACKEND_URL}/file_history', json=file_history) as response:
+                if not response.ok:
+                    logger.warning(f"Error sending file history to backend: {await response.text()}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Unable to connect to backend: {str(e)}")
+            print(f"Error: Unable to connect to backend. Please check if the Flask backend is running.")
+
+        path_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        zip_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        send_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        workers = [
+            *(asyncio.create_task(hash_worker(path_queue, zip_queue)) for _ in range(PIPELINE_WORKERS)),
+            *(asyncio.create_task(zip_worker(zip_queue, send_queue)) for _ in range(PIPELINE_WORKERS)),
+            asyncio.create_task(send_worker(send_queue)),
+            asyncio.create_task(history_flusher())
+        ]
+
+        # With a watcher, passes only cover changed files; a full rescan still runs
+        # every RECONCILE_INTERVAL to pick up anything the watcher missed
+        observer = start_observer(asyncio.get_running_loop())
+        last_full_scan = None
 
-            if ENABLE_CACHE:
-                build_file_size_cache()
-                # Sort by size, smallest first
-                sorted_files = sorted(file_size_cache, key=file_size_cache.get)  
-            else:
-                sorted_files = []
-                for folder in FOLDERS_TO_MONITOR:
-                    for root, _, files in os.walk(folder):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            sorted_files.append(file_path)
-                sorted_files.sort(key=os.path.getsize) # Sort by size, smallest first
-
-            for file_path in sorted_files:
-                await process_file(file_path)
-
-            await asyncio.sleep(CHECK_INTERVAL)
-        except KeyboardInterrupt:
-            logger.info("Bot manually interrupted.")
-            print("Bot manually interrupted.")
-            break
-        except Exception as e:
-            logger.error(f"General error: {str(e)}")
-            await asyncio.sleep(CHECK_INTERVAL)
+        try:
+            while True:
+                try:
+                    clean_old_logs()
+
+                    if observer is None or last_full_scan is None or time.monotonic() - last_full_scan >= RECONCILE_INTERVAL:
+                        changed_paths.clear()
+                        sorted_files = scan_monitored_files()
+                        last_full_scan = time.monotonic()
+                        prune_md5_cache(sorted_files)
+                    else:
+                        sorted_files = take_changed_files()
+
+                    for file_path in sorted_files:
+                        await path_queue.put(file_path)
+
+                    # Wait for the pass to drain through every stage before rescanning
+                    await path_queue.join()
+                    await zip_queue.join()
+                    await send_queue.join()
+
+                    if ENABLE_CACHE and md5_cache_dirty:
+                        md5_cache_dirty = False
+                        save_data(md5_cache, MD5_CACHE_PATH)
+
+                    await asyncio.sleep(CHECK_INTERVAL)
+                except KeyboardInterrupt:
+                    logger.info("Bot manually interrupted.")
+                    print("Bot manually interrupted.")
+                    break
+                except Exception as e:
+                    logger.error(f"General error: {str(e)}")
+                    await asyncio.sleep(CHECK_INTERVAL)
+        finally:
+            # Runs on every shutdown path: break, task cancellation (Ctrl+C) and SystemExit (SIGTERM)
+            for worker in workers:
+                worker.cancel()
+            if observer is not None:
+                observer.stop()
+                observer.join()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    atexit.register(flush_file_history)
+    signal.signal(signal.SIGTERM, signal_handler)
+    asyncio.run(main())
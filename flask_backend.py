@@ -1,20 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory
+import sys
+
+# Use an accelerated, drop-in Deflate implementation for zipfile/pyzipper when one is installed.
+# This must run before zipfile and pyzipper are imported; the archive format is unchanged.
+try:
+    from isal import isal_zlib as _fast_zlib
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as _fast_zlib
+    except ImportError:
+        _fast_zlib = None
+if _fast_zlib is not None:
+    sys.modules['zlib'] = _fast_zlib
+
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, send_from_directory
 import os
 import json
+import orjson
 import configparser
 import pyzipper
 import logging
 import tempfile
+import glob
+import shutil
 import signal
+import threading
 from datetime import datetime, timedelta
 import time
+from collections import deque
 
 # Initialize Flask app
 app = Flask(__name__)
 
 # Global variables to store events and file history
-events = []
+MAX_EVENTS = 10000
+events = deque(maxlen=MAX_EVENTS)  # Only the most recent events are kept, so memory stays bounded
 file_history = {}
+id_index = {}  # file_id -> file path, kept in sync with file_history
+monitor_cache = None  # Serialized /monitor response; None when file_history has changed
+monitor_cache_lock = threading.Lock()
 
 # API statistics data
 api_stats = {
@@ -23,8 +46,15 @@ api_stats = {
     'averageResponseTime': 0,
     'errorsPerSecond': 0,
     'totalErrors': 0,
+    'totalResponseTime': 0,
     'startTime': time.time()
 }
+api_stats_lock = threading.Lock()  # Flask serves requests from several threads
+api_stats_start = time.monotonic()  # Elapsed time is measured on the monotonic clock
+
+# Set when the file history has changes waiting to be written by file_history_saver
+pending_save = threading.Event()
+file_history_write_lock = threading.Lock()  # The saver thread and the shutdown handler share one tmp file
 
 # --- Configure Logging ---
 logger = logging.getLogger(__name__)
@@ -38,6 +68,7 @@ logger.addHandler(file_handler)
 try:
     with open('data/backend_file_history.json', 'r') as f:
         file_history = json.load(f)
+    id_index = {file_data['file_id']: file_path for file_path, file_data in file_history.items()}
     logger.info("File history loaded from data/backend_file_history.json")
 except FileNotFoundError:
     logger.info("File history not found. Creating new file history.")
@@ -49,6 +80,8 @@ config = configparser.ConfigParser()
 config.read('config/config.ini')
 ENABLE_ENCRYPTION = config['General'].getboolean('enable_encryption', False)
 ZIP_PASSWORD = config['General'].get('zip_password', '')
+PARTS_DIR = config['General'].get('parts_dir', 'data/parts')  # Where parts downloaded from Telegram are placed
+COPY_BUFFER_SIZE = 1 << 20  # 1 MiB buffer when sendfile is unavailable
 
 
 # --- Flask Routes ---
@@ -88,56 +121,93 @@ def update_config():
 @app.route('/monitor')
 def monitor():
     """Provides file history data as JSON to the web client."""
-    return jsonify(list(map(lambda item: {'file_path': item[0], **item[1]}, file_history.items())))
+    global monitor_cache
+    with monitor_cache_lock:
+        if monitor_cache is None:
+            monitor_cache = orjson.dumps([{'file_path': file_path, **file_data}
+                                          for file_path, file_data in file_history.items()])
+        content = monitor_cache
+    return Response(content, mimetype='application/json')
+
+
+def invalidate_monitor_cache():
+    """Discards the cached /monitor response; call after every change to file_history."""
+    global monitor_cache
+    with monitor_cache_lock:
+        monitor_cache = None
 
 
 @app.route('/download/<file_id>')
 def download(file_id):
-    """Handles file downloads, including decryption for encrypted files."""
-    found_file = next((file_path for file_path, file_data in file_history.items() if file_data['file_id'] == int(file_id)), None)
+    """Handles file downloads, reassembling split parts and decrypting encrypted files."""
+    found_file = id_index.get(int(file_id))
 
     if found_file:
         logger.info(f"Download requested for file: {found_file}")
 
+        file_data = file_history[found_file]
         base_name = os.path.basename(found_file)
-        with tempfile.TemporaryDirectory() as temp_dir:
-            zip_path = os.path.join(temp_dir, f'{base_name}.zip')
+        archive_name = file_data.get('archive_name') or f'{base_name}.zip'
+        parts_dir = file_data.get('parts_dir') or PARTS_DIR
 
-            # Reconstruct the ZIP file from the sent parts
-            parts = [f for f in os.listdir(temp_dir) if f.startswith(base_name) and f.endswith('.zip')]
-            parts.sort()
+        # Parts are named <archive>.001, <archive>.002, ...; unsplit files keep the archive name
+        parts = sorted(glob.glob(os.path.join(glob.escape(parts_dir), f'{glob.escape(archive_name)}.[0-9][0-9][0-9]')))
+        if not parts and os.path.isfile(os.path.join(parts_dir, archive_name)):
+            parts = [os.path.join(parts_dir, archive_name)]
+        if not parts:
+            logger.warning(f"No downloaded parts found for file: {found_file} in {parts_dir}")
+            return f"No parts of {archive_name} found in {parts_dir}. Download them from Telegram first.", 404
 
-            with open(zip_path, 'wb') as zipf:
-                for part in parts:
-                    with open(os.path.join(temp_dir, part), 'rb') as chunk:
-                        zipf.write(chunk.read())
+        with tempfile.TemporaryDirectory() as temp_dir:
+            zip_path = os.path.join(temp_dir, archive_name)
+            concatenate_parts(parts, zip_path)
 
             # Decrypt the ZIP file if necessary
-            if file_history[found_file]['encrypted']:
+            if file_data['encrypted']:
+                extract_dir = os.path.join(temp_dir, 'extracted')
                 try:
                     with pyzipper.AESZipFile(zip_path, 'r', encryption=pyzipper.WZ_AES) as zipf:
                         zipf.setpassword(ZIP_PASSWORD.encode())
-                        zipf.extractall(path=temp_dir)
+                        zipf.extractall(path=extract_dir)
                         logger.info(f"File decrypted successfully: {found_file}")
                 except Exception as e:
                     logger.error(f"Error decrypting file: {found_file}, {str(e)}")
                     return "Error decrypting file. Please check the password.", 400
+                return send_from_directory(extract_dir, base_name, as_attachment=True)
 
             # Download the ZIP file
-            return send_from_directory(temp_dir, f'{base_name}.zip', as_attachment=True)
+            return send_from_directory(temp_dir, archive_name, as_attachment=True)
     else:
         logger.warning(f"File not found for download: {file_id}")
         return "File not found.", 404
 
 
+def concatenate_parts(parts, output_path):
+    """Concatenates the parts into a single file, using zero-copy sendfile on Linux."""
+    with open(output_path, 'wb') as output:
+        for part in parts:
+            with open(part, 'rb') as part_file:
+                if sys.platform.startswith('linux'):
+                    offset = 0
+                    size = os.fstat(part_file.fileno()).st_size
+                    while offset < size:
+                        sent = os.sendfile(output.fileno(), part_file.fileno(), offset, size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                else:
+                    shutil.copyfileobj(part_file, output, length=COPY_BUFFER_SIZE)
+
+
 @app.route('/file_history', methods=['POST'])
 def update_file_history():
-    global file_history
+    global file_history, id_index
     data = request.get_json()
     if data:
         file_history = data
-        with open('data/backend_file_history.json', 'w') as f:
-            json.dump(file_history, f)
+        id_index = {file_data['file_id']: file_path for file_path, file_data in file_history.items()}
+        invalidate_monitor_cache()
+        save_file_history()
         return "File history updated", 200
     else:
         return "Invalid data", 400
@@ -150,6 +220,10 @@ def handle_event():
     if data:
         events.append(data)
         if data['type'] == 'success':
+            previous = file_history.get(data['file'])
+            if previous:
+                id_index.pop(previous['file_id'], None)
+            id_index[data['file_id']] = data['file']
             file_history[data['file']] = {
                 'hash': data['hash'],
                 'last_sent': datetime.now().isoformat(),
@@ -158,10 +232,13 @@ def handle_event():
                 'encrypted': ENABLE_ENCRYPTION,
                 'encryption_algorithm': "AES" if ENABLE_ENCRYPTION else "None",
                 'file_id': data['file_id'],
+                'archive_name': data.get('archive_name'),
+                'parts_dir': PARTS_DIR,
                 'file_size': data.get('file_size'),
                 'processing_time': data.get('processing_time'),
                 'upload_speed': data.get('upload_speed')
             }
+            invalidate_monitor_cache()
             save_file_history()
         return "Event received", 200
     else:
@@ -169,12 +246,32 @@ def handle_event():
 
 
 def save_file_history():
-    """Saves the file history to a JSON file."""
-    with open('data/backend_file_history.json', 'w') as f:
-        json.dump(file_history, f)
+    """Schedules the file history to be saved by the background saver thread."""
+    pending_save.set()
+
+
+def write_file_history():
+    """Saves the file history to a JSON file, atomically replacing the previous one."""
+    tmp_path = 'data/backend_file_history.json.tmp'
+    with file_history_write_lock:
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(file_history))
+        os.replace(tmp_path, 'data/backend_file_history.json')
     logger.info("File history saved to data/backend_file_history.json")
 
 
+def file_history_saver():
+    """Writes the file history in the background, coalescing saves requested within a second into one write."""
+    while True:
+        pending_save.wait()
+        time.sleep(1)
+        pending_save.clear()
+        try:
+            write_file_history()
+        except Exception as e:
+            logger.error(f"Error saving file history: {str(e)}")
+
+
 @app.route('/clear_logs', methods=['POST'])
 def clear_logs():
     """Clears the log files for both the bot and the backend."""
@@ -199,8 +296,8 @@ def clear_logs():
 
 @app.route('/clear_json_data', methods=['POST'])
 def clear_json_data():
-    """Clears all JSON data files, including bot history, backend history, and the file size cache."""
-    global file_history
+    """Clears all JSON data files, including bot history, backend history, and the file size and MD5 caches."""
+    global file_history, id_index
     try:
         bot_json_path = 'data/bot_file_history.json'
         if os.path.exists(bot_json_path):
@@ -208,11 +305,13 @@ def clear_json_data():
                 json.dump({}, f)
             logger.info(f"Cleared bot JSON data file: {bot_json_path}")
 
-        backend_json_path = 'data/backend_file_history.json'
-        if os.path.exists(backend_json_path):
-            with open(backend_json_path, 'w') as f:
-                json.dump({}, f)
-            logger.info(f"Cleared backend JSON data file: {backend_json_path}")
+        # Clear the in-memory history first and write it under the saver's lock, so a save
+        # that was already in progress cannot put the old history back on disk
+        file_history = {}
+        id_index = {}
+        invalidate_monitor_cache()
+        write_file_history()
+        logger.info("Cleared backend JSON data file: data/backend_file_history.json")
 
         cache_path = 'data/file_size_cache.json'
         if os.path.exists(cache_path):
@@ -220,7 +319,12 @@ def clear_json_data():
                 json.dump({}, f)
             logger.info(f"Cleared file size cache: {cache_path}")
 
-        file_history = {}
+        md5_cache_path = 'data/md5_cache.json'
+        if os.path.exists(md5_cache_path):
+            with open(md5_cache_path, 'w') as f:
+                json.dump({}, f)
+            logger.info(f"Cleared MD5 cache: {md5_cache_path}")
+
         return "JSON data cleared successfully!"
     except Exception as e:
         logger.error(f"Error clearing JSON data: {str(e)}")
@@ -229,17 +333,17 @@ def clear_json_data():
 @app.route('/api_stats')
 def get_api_stats():
     """Provides API statistics data as JSON."""
-    update_api_stats()
-    return jsonify(api_stats)
+    with api_stats_lock:
+        update_api_stats()
+        return jsonify(api_stats)
 
 # --- Helper Functions ---
 
 def update_api_stats():
-    """Updates the API statistics."""
-    global api_stats
-    elapsed_time = time.time() - api_stats['startTime']
+    """Updates the derived API statistics; the caller must hold api_stats_lock."""
+    elapsed_time = time.monotonic() - api_stats_start
     api_stats['requestsPerSecond'] = round(api_stats['totalRequests'] / elapsed_time, 2)
-    api_stats['averageResponseTime'] = round(api_stats['averageResponseTime'] / api_stats['totalRequests'], 2) if api_stats['totalRequests'] > 0 else 0
+    api_stats['averageResponseTime'] = round(api_stats['totalResponseTime'] / api_stats['totalRequests'], 2) if api_stats['totalRequests'] > 0 else 0
     api_stats['errorsPerSecond'] = round(api_stats['totalErrors'] / elapsed_time, 2)
 
 # --- Request Tracking ---
@@ -247,19 +351,18 @@ def update_api_stats():
 @app.before_request
 def before_request():
     """Increments the total requests counter."""
-    global api_stats
-    api_stats['totalRequests'] += 1
-    request.start_time = time.time()
+    with api_stats_lock:
+        api_stats['totalRequests'] += 1
+    request.start_time = time.monotonic()
 
 @app.after_request
 def after_request(response):
     """Calculates response time and tracks errors."""
-    global api_stats
-    response_time = time.time() - request.start_time
-    api_stats['averageResponseTime'] += response_time
-
-    if response.status_code >= 400:
-        api_stats['totalErrors'] += 1
+    response_time = time.monotonic() - request.start_time
+    with api_stats_lock:
+        api_stats['totalResponseTime'] += response_time
+        if response.status_code >= 400:
+            api_stats['totalErrors'] += 1
 
     return response
 
@@ -267,12 +370,15 @@ def after_request(response):
 def signal_handler(sig, frame):
     """Handles graceful shutdown of the Flask app, saving the file history."""
     print('Shutting down gracefully...')
-    save_file_history()
+    write_file_history()
     exit(0)
 
 
+threading.Thread(target=file_history_saver, daemon=True).start()
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Serve with a multi-threaded production WSGI server instead of Werkzeug's debug server
+    from waitress import serve
+    serve(app, host='127.0.0.1', port=5000, threads=16)